@@ -1,14 +1,20 @@
-import h5py
 import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from .lc2latlon import *
+from .lc2latlon import _as_float, _geoloc_for
+from .bands import BandData, VAR_FIELDS
+from .calibration import lut_calibrate
+from .h5utils import decode_attr, open_hdf, read_dataset
 
 class fy4_L1:
     NOMSatHeight = 42164    # 42164km指的是地心到卫星的距离，文件属性信息中的35786km指的是地表到卫星的距离
-    NOMSubSatLon = None     # 星下点经度
-    resolution = None       # 空间分辨率(km)
-    data = {}
-    vars = []
+    # 实例属性均在__init__中赋值, 不使用类级别的可变默认值(各实例会共用同一个对象)
+    __slots__ = ('FileInfo', 'attrs', 'File_name',
+                 'NOMSubSatLon',    # 星下点经度
+                 'resolution',      # 空间分辨率(m)
+                 'Observing_Beginning_DateTime', 'Observing_Ending_DateTime',
+                 'columns', 'lines', 'vars', 'lon', 'lat')
     def __init__(self,fpath):
         """
         Parameters
@@ -17,20 +23,20 @@ class fy4_L1:
             数据文件路径
         """
         # 读取hdf文件
-        self.FileInfo = h5py.File(fpath, "r")
-        # 获得文件属性信息
-        attrs = dict(self.FileInfo.attrs)
+        self.FileInfo = open_hdf(fpath)
+        # 获得文件属性信息(按需读取, 不一次性解码全部属性)
+        attrs = self.FileInfo.attrs
         self.attrs = attrs
 
-        if 'File Name' in attrs.keys():
-            self.File_name = attrs['File Name'].decode('utf8')
+        if 'File Name' in attrs:
+            self.File_name = decode_attr(attrs['File Name'])
         else:
             _, self.File_name = os.path.split(fpath)
         
         # 优先根据文件属性信息获取星下点经度, 没有相关信息则根据文件名获取(需确保文件名符合官方命名规则)
-        if 'NOMSubSatLon' in attrs.keys():
+        if 'NOMSubSatLon' in attrs:
             self.NOMSubSatLon = attrs['NOMSubSatLon']
-        elif 'NOMCenterLon' in attrs.keys():
+        elif 'NOMCenterLon' in attrs:
             self.NOMSubSatLon = attrs['NOMCenterLon']
         else:
             subsatlon_str = self.File_name.split('_')[-9]
@@ -47,8 +53,8 @@ class fy4_L1:
             raise RuntimeError("非标准文件名, 空间分辨率信息缺失！")
         
         # 获取数据的观测起止时间
-        self.Observing_Beginning_DateTime = attrs['Observing Beginning Date'].decode('utf-8') + ' ' + attrs['Observing Beginning Time'].decode('utf-8')
-        self.Observing_Ending_DateTime = attrs['Observing Ending Date'].decode('utf-8') + ' ' + attrs['Observing Ending Time'].decode('utf-8')
+        self.Observing_Beginning_DateTime = decode_attr(attrs['Observing Beginning Date']) + ' ' + decode_attr(attrs['Observing Beginning Time'])
+        self.Observing_Ending_DateTime = decode_attr(attrs['Observing Ending Date']) + ' ' + decode_attr(attrs['Observing Ending Time'])
 
         # 获取标称行列号
         Begin_Line_Number = int(attrs['Begin Line Number'])    # 标称下的起始行号
@@ -62,8 +68,17 @@ class fy4_L1:
         """
         允许以名称索引获取变量数值 
         """
-        # 找到varname所在的group
-        if varname in self.vars:
+        return self._get(varname)
+
+    def _get(self, varname, concurrent=False):
+        """
+        获取变量数值. 多个线程同时读取不同通道时concurrent为True(见h5utils.read_dataset)
+        """
+        # 找到varname所在的group(通过字典键查找, 无需遍历变量列表)
+        if varname in self.data:
+            # 通道在首次访问时才读入内存
+            if self.data[varname] is None:
+                self.data[varname] = read_dataset(self.FileInfo[varname], concurrent=concurrent)
             return self.data[varname]
         elif varname in ['lat', 'lon']:
             return getattr(self, varname)
@@ -74,15 +89,16 @@ class fy4_L1:
         """
         将行列号转为经纬度坐标
         """
-        xx, yy = np.meshgrid(self.columns, self.lines)
-        lon, lat = lc2latlon(xx.flatten(), yy.flatten(), sat='FY4', resolution=self.resolution, sub_lon=self.NOMSubSatLon)
-        self.lon = lon.reshape(xx.shape)
-        self.lat = lat.reshape(yy.shape)
+        # 经纬度网格按分辨率、星下点经度及行列号范围缓存, 同区域多时次文件无需重复计算
+        self.lon, self.lat = _geoloc_for(self.resolution, _as_float(self.NOMSubSatLon),
+                                         int(self.lines[0]), int(self.lines[-1]), int(self.columns[0]), int(self.columns[-1]))
 
 class agri(fy4_L1):
     """
     读取风云4A-AGRI的L1数据
     """
+    __slots__ = ('data',)
+
     def __init__(self, fpath):
         super().__init__(fpath)
         self.read_data()
@@ -91,39 +107,23 @@ class agri(fy4_L1):
     def read_data(self):
         # 获取各通道数值并进行辐射定标
         self.vars = [i for i in self.FileInfo.keys() if i[:10]=='NOMChannel']
-        self.data = {v:self.FileInfo[v][:] for v in self.vars}
+        # 各通道在首次访问时才分别读入独立的数组(形状及数据类型按各自的数据集), 未访问的通道不占用内存
+        self.data = dict.fromkeys(self.vars)
     
     def calibrate(self):
         """
         辐射定标
         """
-        calibrated_data = {}
-        for v in self.vars:
-            nom = self.FileInfo[v]
-            cal = self.FileInfo['CALChannel'+v[10:]]
-            nom_channel = nom[:]
-            cal_channel = cal[:]
-        
-            # 读取数据集属性
-            nom_min, nom_max = nom.attrs['valid_range']
-            cal_min, cal_max = cal.attrs['valid_range']
-            nom_fill_value = nom.attrs['FillValue']
-            cal_fill_value = cal.attrs['FillValue']
-
-            # 数据集掩码和填充值预准备
-            nom_mask = (nom_channel >= nom_min) & (nom_channel <= nom_max) & (nom_channel != nom_fill_value)
-            cal_mask = (cal_channel >= cal_min) | (cal_channel <= cal_max)
-            cal_channel[cal_channel == cal_fill_value] = int(cal_min - 10)
-
-            # 辐射定标
-            target_channel = np.zeros_like(nom_channel, dtype=np.float32)
-            target_channel[nom_mask] = cal_channel[cal_mask][nom_channel[nom_mask]]
-        
-            # 无效值处理(包括不在范围及填充值)
-            target_channel[~nom_mask] = np.nan
-            target_channel[target_channel == int(cal_min - 10)] = np.nan
-            calibrated_data[v] = target_channel
+        # 各通道相互独立, 多线程并行定标(numpy运算及HDF5解压期间释放GIL)
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(self.vars)))) as executor:
+            calibrated_data = dict(zip(self.vars, executor.map(self._calibrate_channel, self.vars)))
         return calibrated_data
+
+    def _calibrate_channel(self, v):
+        """
+        对单个通道进行辐射定标
+        """
+        return lut_calibrate(self.FileInfo[v], self.FileInfo['CALChannel'+v[10:]], self._get(v, concurrent=len(self.vars) > 1))
     
 class giirs(fy4_L1):
     """
@@ -134,51 +134,45 @@ class giirs(fy4_L1):
         self.read_data()
 
     def __getitem__(self, varname):
-        return self.data[varname]
+        if varname not in self.vars:
+            raise KeyError(varname)
+        band, name = VAR_FIELDS[varname]
+        return self.bands[band].view(name)
     
     def get_wavelength(self, var):
-        return self.data[var]['wavelength']
+        return self.bands[VAR_FIELDS[var][0]].get('wavelength')
 
     def read_data(self):
         """
         读取辐射数据
         """
         self.vars = ['VIS', 'NEdRLW', 'NEdRMW', 'RealLW', 'RealMW']
-        self.data = {}
+        # 按波段组织数据, 同一波段的各变量共用经纬度及波数. 仅保存数据集句柄, 首次访问时才读入内存
+        self.bands = {}
         
         # 读取可见光数据并定标
-        self.data['VIS'] = {'data':self.FileInfo['ES_ContVIS'],
-                            'dims':['line', 'column'],
-                            'latitude':self.FileInfo['VIS_Latitude'][:],
-                            'longitude':self.FileInfo['VIS_Longitude'][:],
-                            'wavelength':'single',
-                            }
+        self.bands['VIS'] = BandData(dims=['line', 'column'],
+                                     latitude=self.FileInfo['VIS_Latitude'],
+                                     longitude=self.FileInfo['VIS_Longitude'],
+                                     wavelength='single',
+                                     data=self.FileInfo['ES_ContVIS'],
+                                     )
         # 读取长波红外数据
-        self.data['NEdRLW'] = {'data':self.FileInfo['ES_NEdRLW'][:],
-                            'dims':['wavelength', 'point'],
-                            'latitude':self.FileInfo['IRLW_Latitude'][:],
-                            'longitude':self.FileInfo['IRLW_Longitude'][:],
-                            'wavelength':self.FileInfo['IRLW_VaildWaveLength'][:],
-                            }
-        self.data['RealLW'] = {'data':self.FileInfo['ES_RealLW'][:],
-                            'dims':['wavelength', 'point'],
-                            'latitude':self.FileInfo['IRLW_Latitude'][:],
-                            'longitude':self.FileInfo['IRLW_Longitude'][:],
-                            'wavelength':self.FileInfo['IRLW_VaildWaveLength'][:],
-                            }
+        self.bands['LW'] = BandData(dims=['wavelength', 'point'],
+                                    latitude=self.FileInfo['IRLW_Latitude'],
+                                    longitude=self.FileInfo['IRLW_Longitude'],
+                                    wavelength=self.FileInfo['IRLW_VaildWaveLength'],
+                                    NEdR=self.FileInfo['ES_NEdRLW'],
+                                    Real=self.FileInfo['ES_RealLW'],
+                                    )
         # 读取中波红外数据
-        self.data['NEdRMW'] = {'data':self.FileInfo['ES_NEdRMW'][:],
-                            'dims':['wavelength', 'point'],
-                            'latitude':self.FileInfo['IRMW_Latitude'][:],
-                            'longitude':self.FileInfo['IRMW_Longitude'][:],
-                            'wavelength':self.FileInfo['IRMW_VaildWaveLength'][:],
-                            }
-        self.data['RealMW'] = {'data':self.FileInfo['ES_RealMW'][:],
-                            'dims':['wavelength', 'point'],
-                            'latitude':self.FileInfo['IRMW_Latitude'][:],
-                            'longitude':self.FileInfo['IRMW_Longitude'][:],
-                            'wavelength':self.FileInfo['IRMW_VaildWaveLength'][:],
-                            }
+        self.bands['MW'] = BandData(dims=['wavelength', 'point'],
+                                    latitude=self.FileInfo['IRMW_Latitude'],
+                                    longitude=self.FileInfo['IRMW_Longitude'],
+                                    wavelength=self.FileInfo['IRMW_VaildWaveLength'],
+                                    NEdR=self.FileInfo['ES_NEdRMW'],
+                                    Real=self.FileInfo['ES_RealMW'],
+                                    )
     def calibrate(self):
         """
         对FY4A/GIIRS的可见光数据进行定标
@@ -199,30 +193,7 @@ class giirs(fy4_L1):
         target_channel : array
             辐射定标后的数据
         """
-        # 读取数据集
-        nom = self.FileInfo['ES_ContVIS']
-        cal = self.FileInfo['ES_CalSTableVIS']
-        nom_channel = nom[:]
-        cal_channel = cal[:]
-
-        # 读取数据集属性
-        nom_min, nom_max = nom.attrs['valid_range']
-        cal_min, cal_max = cal.attrs['valid_range']
-        nom_fill_value = nom.attrs['FillValue']
-        cal_fill_value = cal.attrs['FillValue']
-
-        # 数据集掩码和填充值预准备
-        nom_mask = (nom_channel >= nom_min) & (nom_channel <= nom_max) & (nom_channel != nom_fill_value)
-
-        # 辐射定标
-        target_channel = np.zeros_like(nom_channel, dtype=np.float32)
-        cal_mask = (cal_channel >= cal_min) | (cal_channel <= cal_max)
-        cal_channel[cal_channel == cal_fill_value] = int(cal_min - 10)
-        target_channel[nom_mask] = cal_channel[cal_mask][nom_channel[nom_mask]]
-    
-        # 无效值处理(包括不在范围及填充值)
-        target_channel[~nom_mask] = np.nan
-        target_channel[target_channel == int(cal_min - 10)] = np.nan
-    
-        return {'VIS': target_channel}
+        # DN值与self['VIS']共用, 已读取时不重复读取
+        return {'VIS': lut_calibrate(self.FileInfo['ES_ContVIS'], self.FileInfo['ES_CalSTableVIS'],
+                                     self.bands['VIS'].get('data'))}
 
@@ -1,39 +1,55 @@
 import numpy as np
-import h5py
 import os
-from .lc2latlon import lc2latlon
+from concurrent.futures import ThreadPoolExecutor
+from .lc2latlon import _as_float, _geoloc_for
+from .bands import BandData, VAR_FIELDS
+from .calibration import apply_lut, build_lut, lut_calibrate
+from .h5utils import decode_attr, open_hdf, read_dataset
+
+try:
+    import dask.array as da
+except ImportError:     # dask为可选依赖, 仅lazy=True时需要
+    da = None
 
 class agri:
     """
     读取风云4B-AGRI的L1数据
     """
     NOMSatHeight = 42164    # 42164km指的是地心到卫星的距离，文件属性信息中的35786km指的是地表到卫星的距离
-    NOMSubSatLon = None     # 星下点经度
-    resolution = None       # 空间分辨率(km)
-    data = {}
-    vars = []
-    def __init__(self,fpath):
+    # 实例属性均在__init__中赋值, 不使用类级别的可变默认值(各实例会共用同一个对象)
+    __slots__ = ('FileInfo', 'attrs', 'File_name',
+                 'NOMSubSatLon',    # 星下点经度
+                 'resolution',      # 空间分辨率(m)
+                 'Observing_Beginning_DateTime', 'Observing_Ending_DateTime',
+                 'columns', 'lines', 'vars', 'lon', 'lat',
+                 'data', 'lazy', '_dask')
+    def __init__(self, fpath, lazy=False):
         """
         Parameters
         -----
         fpath : str
             数据文件路径
+        lazy : bool, default=False
+            为True时各通道及定标结果均以dask数组返回, 计算(compute)时才按分块读取, 需安装dask
         """
+        if lazy and da is None:
+            raise ImportError("lazy=True需要安装dask")
+        self.lazy = lazy
         # 读取hdf文件
-        self.FileInfo = h5py.File(fpath, "r")
-        # 获得文件属性信息
-        attrs = dict(self.FileInfo.attrs)
+        self.FileInfo = open_hdf(fpath)
+        # 获得文件属性信息(按需读取, 不一次性解码全部属性)
+        attrs = self.FileInfo.attrs
         self.attrs = attrs
 
-        if 'File Name' in attrs.keys():
-            self.File_name = attrs['File Name'].decode('utf8')
+        if 'File Name' in attrs:
+            self.File_name = decode_attr(attrs['File Name'])
         else:
             _, self.File_name = os.path.split(fpath)
         
         # 优先根据文件属性信息获取星下点经度, 没有相关信息则根据文件名获取(需确保文件名符合官方命名规则)
-        if 'NOMSubSatLon' in attrs.keys():
+        if 'NOMSubSatLon' in attrs:
             self.NOMSubSatLon = attrs['NOMSubSatLon']
-        elif 'NOMCenterLon' in attrs.keys():
+        elif 'NOMCenterLon' in attrs:
             self.NOMSubSatLon = attrs['NOMCenterLon']
         else:
             subsatlon_str = self.File_name.split('_')[-9]
@@ -50,8 +66,8 @@ class agri:
             raise RuntimeError("非标准文件名, 空间分辨率信息缺失！")
         
         # 获取数据的观测起止时间
-        self.Observing_Beginning_DateTime = attrs['Observing Beginning Date'].decode('utf-8') + ' ' + attrs['Observing Beginning Time'].decode('utf-8')
-        self.Observing_Ending_DateTime = attrs['Observing Ending Date'].decode('utf-8') + ' ' + attrs['Observing Ending Time'].decode('utf-8')
+        self.Observing_Beginning_DateTime = decode_attr(attrs['Observing Beginning Date']) + ' ' + decode_attr(attrs['Observing Beginning Time'])
+        self.Observing_Ending_DateTime = decode_attr(attrs['Observing Ending Date']) + ' ' + decode_attr(attrs['Observing Ending Time'])
 
         # 获取标称行列号
         Begin_Line_Number = int(attrs['Begin Line Number'])    # 标称下的起始行号
@@ -68,8 +84,19 @@ class agri:
         """
         允许以名称索引获取变量数值 
         """
-        # 找到varname所在的group
-        if varname in self.vars:
+        return self._get(varname)
+
+    def _get(self, varname, concurrent=False):
+        """
+        获取变量数值. 多个线程同时读取不同通道时concurrent为True(见h5utils.read_dataset)
+        """
+        # 找到varname所在的group(通过字典键查找, 无需遍历变量列表)
+        if varname in self.data:
+            if self.lazy:
+                return self._dask[varname]
+            # 通道在首次访问时才读入内存
+            if self.data[varname] is None:
+                self.data[varname] = read_dataset(self.FileInfo['Data'][varname], concurrent=concurrent)
             return self.data[varname]
         elif varname in ['lat', 'lon']:
             return getattr(self, varname)
@@ -79,55 +106,54 @@ class agri:
     def read_data(self):
         # 获取各通道数值并进行辐射定标
         self.vars = [i for i in self.FileInfo['Data'].keys() if i.startswith('NOMChannel')]
-        self.data = {v:self.FileInfo['Data'][v][:] for v in self.vars}
+        # 各通道在首次访问时才分别读入独立的数组(形状及数据类型按各自的数据集), 未访问的通道不占用内存
+        self.data = dict.fromkeys(self.vars)
+        if self.lazy:
+            # 以dask数组包装数据集句柄, 按HDF5分块切分
+            self._dask = {}
+            for v in self.vars:
+                dset = self.FileInfo['Data'][v]
+                self._dask[v] = da.from_array(dset, chunks=dset.chunks or 'auto')
 
     def lc2latlon(self):
         """
         将行列号转为经纬度坐标
         """
-        xx, yy = np.meshgrid(self.columns, self.lines)
-        lon, lat = lc2latlon(xx.flatten(), yy.flatten(), sat='FY4', resolution=self.resolution, sub_lon=self.NOMSubSatLon)
-        self.lon = lon.reshape(xx.shape)
-        self.lat = lat.reshape(yy.shape)
+        # 经纬度网格按分辨率、星下点经度及行列号范围缓存, 同区域多时次文件无需重复计算
+        self.lon, self.lat = _geoloc_for(self.resolution, _as_float(self.NOMSubSatLon),
+                                         int(self.lines[0]), int(self.lines[-1]), int(self.columns[0]), int(self.columns[-1]))
     
     def calibrate(self):
         """
         辐射定标
         """
-        calibrated_data = {}
-        for v in self.vars:
-            nom = self.FileInfo['Data'][v]
-            cal = self.FileInfo['Calibration'][v.replace('NOM', 'CAL')]
-            nom_channel = nom[:]
-            cal_channel = cal[:]
-        
-            # 读取数据集属性
-            nom_min, nom_max = nom.attrs['valid_range']
-            cal_min, cal_max = cal.attrs['valid_range']
-            nom_fill_value = nom.attrs['FillValue']
-            cal_fill_value = cal.attrs['FillValue']
-
-            # 数据集掩码和填充值预准备
-            nom_mask = (nom_channel >= nom_min) & (nom_channel <= nom_max) & (nom_channel != nom_fill_value)
-            cal_mask = (cal_channel >= cal_min) | (cal_channel <= cal_max)
-            cal_channel[cal_channel == cal_fill_value] = int(cal_min - 10)
-
-            # 辐射定标
-            target_channel = np.zeros_like(nom_channel, dtype=np.float32)
-            target_channel[nom_mask] = cal_channel[cal_mask][nom_channel[nom_mask]]
-        
-            # 无效值处理(包括不在范围及填充值)
-            target_channel[~nom_mask] = np.nan
-            target_channel[target_channel == int(cal_min - 10)] = np.nan
-            calibrated_data[v] = target_channel
+        if self.lazy:
+            # 查找表很小, 立即构建; 逐块查表延迟到compute时执行.
+            # dask会在多个线程中同时调用apply_lut, 其中的numba函数须为串行实现(见calibration._lut_calibrate_kernel)
+            calibrated_data = {}
+            for v in self.vars:
+                lut_args = build_lut(self.FileInfo['Data'][v], self.FileInfo['Calibration'][v.replace('NOM', 'CAL')])
+                calibrated_data[v] = da.map_blocks(apply_lut, self[v], *lut_args, dtype=np.float32)
+            return calibrated_data
+        # 各通道相互独立, 多线程并行定标(numpy运算及HDF5解压期间释放GIL)
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(self.vars)))) as executor:
+            calibrated_data = dict(zip(self.vars, executor.map(self._calibrate_channel, self.vars)))
         return calibrated_data
 
+    def _calibrate_channel(self, v):
+        """
+        对单个通道进行辐射定标
+        """
+        return lut_calibrate(self.FileInfo['Data'][v], self.FileInfo['Calibration'][v.replace('NOM', 'CAL')], self._get(v, concurrent=len(self.vars) > 1))
+
 class ghi(agri):
     """
     读取风云4B-GHI的L1数据
     """
-    def __init__(self, fpath):
-        super().__init__(fpath)
+    __slots__ = ()
+
+    def __init__(self, fpath, lazy=False):
+        super().__init__(fpath, lazy)
 
 class giirs:
     """
@@ -141,20 +167,20 @@ class giirs:
             数据文件路径
         """
         # 读取hdf文件
-        self.FileInfo = h5py.File(fpath, "r")
-        # 获得文件属性信息
-        attrs = dict(self.FileInfo.attrs)
+        self.FileInfo = open_hdf(fpath)
+        # 获得文件属性信息(按需读取, 不一次性解码全部属性)
+        attrs = self.FileInfo.attrs
         self.attrs = attrs
 
-        if 'File Name' in attrs.keys():
-            self.File_name = attrs['File Name'].decode('utf8')
+        if 'File Name' in attrs:
+            self.File_name = decode_attr(attrs['File Name'])
         else:
             _, self.File_name = os.path.split(fpath)
         
         # 优先根据文件属性信息获取星下点经度, 没有相关信息则根据文件名获取(需确保文件名符合官方命名规则)
-        if 'NOMSubSatLon' in attrs.keys():
+        if 'NOMSubSatLon' in attrs:
             self.NOMSubSatLon = attrs['NOMSubSatLon']
-        elif 'NOMCenterLon' in attrs.keys():
+        elif 'NOMCenterLon' in attrs:
             self.NOMSubSatLon = attrs['NOMCenterLon']
         else:
             subsatlon_str = self.File_name.split('_')[-9]
@@ -171,8 +197,8 @@ class giirs:
             raise RuntimeError("非标准文件名, 空间分辨率信息缺失！")
         
         # 获取数据的观测起止时间
-        self.Observing_Beginning_DateTime = attrs['Observing Beginning Date'].decode('utf-8') + ' ' + attrs['Observing Beginning Time'].decode('utf-8')
-        self.Observing_Ending_DateTime = attrs['Observing Ending Date'].decode('utf-8') + ' ' + attrs['Observing Ending Time'].decode('utf-8')
+        self.Observing_Beginning_DateTime = decode_attr(attrs['Observing Beginning Date']) + ' ' + decode_attr(attrs['Observing Beginning Time'])
+        self.Observing_Ending_DateTime = decode_attr(attrs['Observing Ending Date']) + ' ' + decode_attr(attrs['Observing Ending Time'])
 
         # 获取标称行列号
         Begin_Line_Number = int(attrs['Begin Line Number'])    # 标称下的起始行号
@@ -185,60 +211,44 @@ class giirs:
         self.read_data()
 
     def __getitem__(self, varname):
-        return self.data[varname]
+        if varname not in self.vars:
+            raise KeyError(varname)
+        band, name = VAR_FIELDS[varname]
+        return self.bands[band].view(name)
 
     def read_data(self):
         """
         读取辐射数据
         """
         self.vars = ['VIS', 'NEdRLW', 'NEdRMW', 'RealLW', 'RealMW', 'ImaginaryLW', 'ImaginaryMW']
-        self.data = {}
+        # 按波段组织数据, 同一波段的各变量共用经纬度及波数. 仅保存数据集句柄, 首次访问时才读入内存
+        self.bands = {}
         
         # 读取可见光数据并定标
-        self.data['VIS'] = {'data':self.FileInfo['Data']['VIS_DN'][:],
-                            'dims':['line', 'column'],
-                            'latitude':self.FileInfo['Geolocation']['Latitude_VIS'][:],
-                            'longitude':self.FileInfo['Geolocation']['Longitude_VIS'][:],
-                            'wavelength':'single',
-                            }
+        self.bands['VIS'] = BandData(dims=['line', 'column'],
+                                     latitude=self.FileInfo['Geolocation']['Latitude_VIS'],
+                                     longitude=self.FileInfo['Geolocation']['Longitude_VIS'],
+                                     wavelength='single',
+                                     data=self.FileInfo['Data']['VIS_DN'],
+                                     )
         # 读取长波红外数据
-        self.data['NEdRLW'] = {'data':self.FileInfo['Data']['NEdR_LW'][:],
-                            'dims':['wavelength', 'point'],
-                            'latitude':self.FileInfo['Geolocation']['Latitude_LW'][:],
-                            'longitude':self.FileInfo['Geolocation']['Longitude_LW'][:],
-                            'wavelength':self.FileInfo['Data']['WN_LW'][:],
-                            }
-        self.data['RealLW'] = {'data':self.FileInfo['Data']['ES_RealLW'][:],
-                            'dims':['wavelength', 'point'],
-                            'latitude':self.FileInfo['Geolocation']['Latitude_LW'][:],
-                            'longitude':self.FileInfo['Geolocation']['Longitude_LW'][:],
-                            'wavelength':self.FileInfo['Data']['WN_LW'][:],
-                            }
-        self.data['ImaginaryLW'] = {'data':self.FileInfo['Data']['ES_ImaginaryLW'][:],
-                            'dims':['wavelength', 'point'],
-                            'latitude':self.FileInfo['Geolocation']['Latitude_LW'][:],
-                            'longitude':self.FileInfo['Geolocation']['Longitude_LW'][:],
-                            'wavelength':self.FileInfo['Data']['WN_LW'][:],
-                            }
+        self.bands['LW'] = BandData(dims=['wavelength', 'point'],
+                                    latitude=self.FileInfo['Geolocation']['Latitude_LW'],
+                                    longitude=self.FileInfo['Geolocation']['Longitude_LW'],
+                                    wavelength=self.FileInfo['Data']['WN_LW'],
+                                    NEdR=self.FileInfo['Data']['NEdR_LW'],
+                                    Real=self.FileInfo['Data']['ES_RealLW'],
+                                    Imaginary=self.FileInfo['Data']['ES_ImaginaryLW'],
+                                    )
         # 读取中波红外数据
-        self.data['NEdRMW'] = {'data':self.FileInfo['Data']['NEdR_MW'][:],
-                            'dims':['wavelength', 'point'],
-                            'latitude':self.FileInfo['Geolocation']['Latitude_MW'][:],
-                            'longitude':self.FileInfo['Geolocation']['Longitude_MW'][:],
-                            'wavelength':self.FileInfo['Data']['WN_MW'][:],
-                            }
-        self.data['RealMW'] = {'data':self.FileInfo['Data']['ES_RealMW'][:],
-                            'dims':['wavelength', 'point'],
-                            'latitude':self.FileInfo['Geolocation']['Latitude_MW'][:],
-                            'longitude':self.FileInfo['Geolocation']['Longitude_MW'][:],
-                            'wavelength':self.FileInfo['Data']['WN_MW'][:],
-                            }
-        self.data['ImaginaryMW'] = {'data':self.FileInfo['Data']['ES_ImaginaryMW'][:],
-                            'dims':['wavelength', 'point'],
-                            'latitude':self.FileInfo['Geolocation']['Latitude_MW'][:],
-                            'longitude':self.FileInfo['Geolocation']['Longitude_MW'][:],
-                            'wavelength':self.FileInfo['Data']['WN_MW'][:],
-                            }
+        self.bands['MW'] = BandData(dims=['wavelength', 'point'],
+                                    latitude=self.FileInfo['Geolocation']['Latitude_MW'],
+                                    longitude=self.FileInfo['Geolocation']['Longitude_MW'],
+                                    wavelength=self.FileInfo['Data']['WN_MW'],
+                                    NEdR=self.FileInfo['Data']['NEdR_MW'],
+                                    Real=self.FileInfo['Data']['ES_RealMW'],
+                                    Imaginary=self.FileInfo['Data']['ES_ImaginaryMW'],
+                                    )
     def calibrate(self):
         """
         对FY4B/GIIRS的可见光数据进行定标
@@ -262,8 +272,8 @@ class giirs:
         # 读取数据集
         nom = self.FileInfo['Data']['VIS_DN']
         cal = self.FileInfo['Data']['VIS_CalTable']
-        nom_channel = nom[:]
-        cal_channel = cal[:]
+        nom_channel = self.bands['VIS'].get('data')    # 与self['VIS']共用
+        cal_channel = read_dataset(cal)
 
         # 读取数据集属性
         nom_min, nom_max = nom.attrs['valid_range']
@@ -275,15 +285,12 @@ class giirs:
         nom_mask = (nom_channel >= nom_min) & (nom_channel <= nom_max) & (nom_channel != nom_fill_value)
 
         # 辐射定标
-        target_channel = np.zeros_like(nom_channel, dtype=np.float32)
         a1 = cal_channel[:, :, 0]
         bias = cal_channel[:, :, 1]
         a0 = cal_channel[:, :, 2]
-        reflectence = a1 * (nom_channel - bias) + a0
-        target_channel = reflectence
+        target_channel = a1 * (nom_channel - bias) + a0
     
         # 无效值处理(包括不在范围及填充值)
         target_channel[~nom_mask] = np.nan
-        target_channel[target_channel == int(cal_min - 10)] = np.nan
     
         return {'VIS': target_channel}
\ No newline at end of file
@@ -1,9 +1,67 @@
 # 此脚本用于读取Himawari-8卫星的HSD数据
 import os
 import bz2
+import functools
 import json
 import numpy as np
 from .lc2latlon import lc2latlon
+from .lc2latlon import _as_float
+
+try:
+    from ._hsd_numba import _hsd_albedo_kernel, _hsd_tb_kernel
+except ImportError:     # numba为可选依赖, 未安装时使用numpy实现
+    _hsd_albedo_kernel = _hsd_tb_kernel = None
+
+# 格式规则中的类型代号与dtype的对应关系(HSD数据为小端字节序)
+_HSD_DTYPES = {'i1': 'u1', 'i2': '<u2', 'i4': '<u4', 'R4': '<f4', 'R8': '<f8'}
+
+def _block_dtypes(formation_band):
+    """
+    根据格式规则为每个块构建结构化dtype, 每个块只需一次np.frombuffer
+    """
+    block_dtypes = []
+    for name, dtype, byte_nums in formation_band:
+        if name.startswith('Block number'):
+            fields = []
+            block_dtypes.append(fields)
+        if dtype == '' or name == 'Count value of each pixel':
+            # 块末尾的空白填充按块长度跳过, 像元数据单独读取
+            continue
+        elif dtype == 'C':
+            fields.append((name, f'S{byte_nums}'))
+        else:
+            fields.append((name, _HSD_DTYPES[dtype], (byte_nums,)))
+    return [np.dtype(fields) for fields in block_dtypes]
+
+# Himawari-8二进制格式化规则, 导入时读取一次, 各文件共用
+with open(os.path.join(os.path.dirname(__file__), '../config/Himawari_Standard_Data.json')) as _f:
+    _HSD_FORM = json.load(_f)
+_HSD_FRAME = _HSD_FORM['Frame']
+_HSD_BLOCK_DTYPES = {k: _block_dtypes(v) for k, v in _HSD_FORM['Formation'].items()}
+
+@functools.lru_cache(maxsize=32)
+def _planck_coefs(wl, h, k, c):
+    """
+    计算由辐射率求有效亮温的普朗克公式系数: Te = a / ln(b / radiance + 1)
+
+    系数只取决于波段的中心波长及物理常数, 同一波段的各文件共用
+
+    Parameters
+    -----
+    wl : float
+        中心波长(μm)
+    h, k, c : float
+        普朗克常数、玻尔兹曼常数、光速(国际单位)
+
+    Returns
+    -----
+    a, b : float
+        公式系数, 其中b已换算为辐射率单位W / (m2 * sr * μm)
+    """
+    wl = wl * 1e-6    # μm -> m
+    a = h * c / k / wl
+    b = 2 * h * c * c / (wl ** 5) * 1e-6    # W / (m2 * sr * m) -> W / (m2 * sr * μm)
+    return a, b
 
 class himawari8_hsd:
     """
@@ -11,8 +69,6 @@ class himawari8_hsd:
     """
     satellite = 'Himawari 8'
     product = 'HSD'
-    vars = []
-    Data = {}
     def __init__(self, fpath):
         fname = os.path.basename(fpath)
         self._fmt = fname.split('.')[-1]    # 文件格式
@@ -20,6 +76,7 @@ class himawari8_hsd:
         self.observation_start_datetime = fname.split('_')[2] + fname.split('_')[3]   # 观测开始时间
         self.observation_area = fname.split('_')[5] # 观测区域
         self.band = int(fname.split('_')[4][1:]) # 波段号
+        self.vars = []  # 定标后可用的数据变量
 
         FileInfo = self.read_binfile(fpath)
         self.FileInfo = FileInfo
@@ -54,18 +111,7 @@ class himawari8_hsd:
         """
         从Himawari二进制文件中读取数据信息
         """
-        if self._fmt == 'bz2':
-            with bz2.open(fpath, 'rb') as f:
-                info = f.read()
-        elif self._fmt == 'DAT':
-            with open(fpath, 'rb') as f:
-                info = f.read()
-        
-        # 定义Himawari-8二进制格式化规则
-        with open(os.path.join(os.path.dirname(__file__), '../config/Himawari_Standard_Data.json')) as f:
-            hsd_form = json.load(f)
-            formation = hsd_form['Formation']
-            frame = hsd_form['Frame']
+        frame = _HSD_FRAME
         # 根据观测区域筛选信息
         if self.observation_area == "FLDK":
             frame_area = frame['FullDisk']
@@ -85,71 +131,42 @@ class himawari8_hsd:
         EW_size, NS_size = frame_area_band['East-west direction'], frame_area_band['North-south direction']
 
         if self.band < 7:
-            formation_band = formation['band1_6']
+            block_dtypes = _HSD_BLOCK_DTYPES['band1_6']
         else:
-            formation_band = formation['band7_16']
-
-        # 读取二进制数据并解码
-        fileinfo = {}   # 用字典保存解码结果
-        pos = 0 # 当前二进制流中读取到的位置索引
-        block_length = np.nan   # 当前块的总字节数
-        block_count = 0 # 当前块已经读取的字节数
-        block_names = ['Basic information', 'Data information', 'Projection information', 'Navigation information', 'Calibration information', 'Inter-calibration information', 'Segment information', 'Navigation correction information', 'Observation time information', 'Error information', 'Spare', 'Data']
-        block_index = -1
-        for fm in formation_band:
-            # 提取值的名称、类型代号、字节数
-            name, dtype, byte_nums = fm
-            # 将类型代号转换为dtype，并计算值所占的字节数
-            if dtype == 'i1':
-                length = 1 * byte_nums
-                dtp = np.uint8
-            elif dtype == 'i2':
-                length = 2 * byte_nums
-                dtp = np.uint16
-            elif dtype == 'i4':
-                length = 4 * byte_nums
-                dtp = np.uint32
-            elif dtype == 'C':
-                length = 1 * byte_nums
-            elif dtype == 'R4':
-                length = 4 * byte_nums
-                dtp = np.float32
-            elif dtype == 'R8':
-                length = 8 * byte_nums
-                dtp = np.float64
-            elif dtype == '':
-                length = byte_nums*40
-            else:
-                raise
+            block_dtypes = _HSD_BLOCK_DTYPES['band7_16']
 
-            if name.startswith('Block number'):
-                block = {}  # 新字典保存当前块的信息
-                block_index += 1
-            
-            if name == 'Count value of each pixel':
-                # 此时定位到整个数据尾端，也是数值区域
-                byte_nums = EW_size * NS_size
-                length = byte_nums * 2
-                value = np.frombuffer(info[pos:pos+length], dtype=dtp)
-                fileinfo['Data'] = {name:value}
-
-            if dtype == '':
-                # 此时定位到block的末尾空白填充
-                pos += (block_length - block_count) # 跳过空白填充
-                block_count = 0 # block计数器重置为0
-                fileinfo[block_names[block_index]] = block  # 将block添加到fileinfo
-                continue
-            elif dtype == 'C':
-                value = np.char.decode(info[pos:pos+length], encoding='ascii')
-                block[name] = value
-            else:
-                value = np.frombuffer(info[pos:pos+length], dtype=dtp)
-                block[name] = value
-                if name.startswith('Block length'):
-                    block_length = value[0]
+        # 读取二进制数据并解码. 流式读取: 先读头信息, 再将像元数据直接读入预分配的数组, 不生成整个文件的bytes对象
+        if self._fmt == 'bz2':
+            f = bz2.open(fpath, 'rb')
+        elif self._fmt == 'DAT':
+            f = open(fpath, 'rb')
+        with f:
+            # 第1块中记录了头信息总长度
+            info = f.read(block_dtypes[0].itemsize)
+            header_length = int(np.frombuffer(info, dtype=block_dtypes[0], count=1)[0]['Total header length'][0])
+            info += f.read(header_length - len(info))
+
+            fileinfo = {}   # 用字典保存解码结果
+            pos = 0 # 当前二进制流中读取到的位置索引
+            block_names = ['Basic information', 'Data information', 'Projection information', 'Navigation information', 'Calibration information', 'Inter-calibration information', 'Segment information', 'Navigation correction information', 'Observation time information', 'Error information', 'Spare']
+            for block_name, block_dtype in zip(block_names, block_dtypes):
+                values = np.frombuffer(info, dtype=block_dtype, count=1, offset=pos)[0]
+                block = {}
+                for name in block_dtype.names:
+                    if block_dtype.fields[name][0].kind == 'S':
+                        block[name] = np.char.decode(values[name], encoding='ascii')
+                    else:
+                        block[name] = values[name]
+                fileinfo[block_name] = block
+                pos += int(values[1][0])    # 按块长度跳到下一个块(含空白填充)
 
-            pos += length
-            block_count += length
+            # 此时定位到整个数据尾端，也是数值区域. 分段文件只包含部分行, 像元数按本段的行列数计算
+            columns = int(fileinfo['Data information']['Number of columns'][0])
+            lines = int(fileinfo['Data information']['Number of lines'][0])
+            value = np.empty(min(columns * lines, EW_size * NS_size), dtype='<u2')
+            nbytes = f.readinto(memoryview(value).cast('B'))
+            value = value[:nbytes // 2]
+        fileinfo['Data'] = {'Count value of each pixel': value}
         self.DN = fileinfo['Data']['Count value of each pixel'] 
         return fileinfo
 
@@ -160,10 +177,10 @@ class himawari8_hsd:
         columns = self.FileInfo["Data information"]["Number of columns"]
         lines = self.FileInfo["Data information"]["Number of lines"]
         first_line = self.FileInfo['Segment information']['First line number of image segment']
-        xx, yy = np.meshgrid(np.arange(1, columns+1, 1), np.arange(first_line, first_line+lines, 1))
-        lon, lat = lc2latlon(xx.flatten(), yy.flatten(), sat='Himawari8', **self.proj_args)
-        self.lon = lon.reshape(xx.shape)
-        self.lat = lat.reshape(yy.shape)
+        # 列号(C,)与行号(L, 1)广播, 直接得到(L, C)的经纬度网格
+        self.lon, self.lat = lc2latlon(np.arange(1, columns+1, 1),
+                                       np.arange(first_line, first_line+lines, 1).reshape(-1, 1),
+                                       sat='Himawari8', **self.proj_args)
     
     def calibrate(self):
         """
@@ -171,30 +188,46 @@ class himawari8_hsd:
         """
         self.vars = ['radiance']    # 辐射率
         data = self.FileInfo['Data']['Count value of each pixel']    # 读取原始DN值
-        gain = self.FileInfo['Calibration information']["Calibrated Slope for count-radiance conversion equation_updated value of No. 8 of this block"]
-        offset = self.FileInfo['Calibration information']["Calibrated Intercept for count-radiance conversion equation_updated value of No. 9 of this block"]
-        
+        cal_info = self.FileInfo['Calibration information']
+        self.radiance = np.empty(data.shape, dtype=np.float64)     # W / (m2 * sr * μm)
+        out = np.empty(data.shape, dtype=np.float64)
+
         # 1~6波段定标为反射率，7~16波段定标为亮温
         if self.band < 7:
             # 根据辐射率计算反射率
-            gain = self.FileInfo['Calibration information']["Calibrated Slope for count-radiance conversion equation_updated value of No. 8 of this block"]
-            offset = self.FileInfo['Calibration information']["Calibrated Intercept for count-radiance conversion equation_updated value of No. 9 of this block"]
-            # 计算辐射率
-            self.radiance = data * gain + offset     # W / (m2 * sr * μm)
-            albedo = self.radiance * self.FileInfo['Calibration information']["Coefficient for transformation from radiance  to albedo"]
-            return albedo
+            gain = _as_float(cal_info["Calibrated Slope for count-radiance conversion equation_updated value of No. 8 of this block"])
+            offset = _as_float(cal_info["Calibrated Intercept for count-radiance conversion equation_updated value of No. 9 of this block"])
+            coef = _as_float(cal_info["Coefficient for transformation from radiance  to albedo"])
+            if _hsd_albedo_kernel is not None:
+                # 辐射率与反射率在同一次遍历中算出, 不产生中间数组
+                _hsd_albedo_kernel(data, gain, offset, coef, self.radiance, out)
+            else:
+                np.multiply(data, gain, out=self.radiance)
+                self.radiance += offset
+                np.multiply(self.radiance, coef, out=out)
+            return out
         else:
-            gain = self.FileInfo['Calibration information']["Slope for count-radiance conversion equation"]
-            offset = self.FileInfo['Calibration information']["Intercept for count-radiance conversion equation"]
-            self.radiance = data * gain + offset     # W / (m2 * sr * μm)
+            gain = _as_float(cal_info["Slope for count-radiance conversion equation"])
+            offset = _as_float(cal_info["Intercept for count-radiance conversion equation"])
             # 根据辐射率计算亮温
-            c0 = self.FileInfo['Calibration information']["radiance to brightness temperature_c0"]
-            c1 = self.FileInfo['Calibration information']["radiance to brightness temperature_c1"]
-            c2 = self.FileInfo['Calibration information']["radiance to brightness temperature_c2"]
-            wl = self.FileInfo["central wave length"]
-            h = self.FileInfo['Calibration information']["Planck constant"]
-            k = self.FileInfo['Calibration information']["Boltzmann constant"]
-            c = self.FileInfo['Calibration information']["Speed of light"]
-            Te = h * c / k / wl / np.log(2*h*c*c/((wl**5)*self.radiance)+1) # 有效亮温
-            self.Tb = c0 + c1 * Te + c2 * Te * Te    # 亮温
-            return Tb
+            c0 = _as_float(cal_info["radiance to brightness temperature_c0"])
+            c1 = _as_float(cal_info["radiance to brightness temperature_c1"])
+            c2 = _as_float(cal_info["radiance to brightness temperature_c2"])
+            a, b = _planck_coefs(_as_float(cal_info["Central wave length"]),
+                                 _as_float(cal_info["Planck constant"]),
+                                 _as_float(cal_info["Boltzmann constant"]),
+                                 _as_float(cal_info["Speed of light"]))
+            if _hsd_tb_kernel is not None:
+                _hsd_tb_kernel(data, gain, offset, a, b, c0, c1, c2, self.radiance, out)
+            else:
+                np.multiply(data, gain, out=self.radiance)
+                self.radiance += offset
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    np.divide(b, self.radiance, out=out)
+                    out += 1
+                    np.log(out, out=out)
+                    np.divide(a, out, out=out)  # 有效亮温
+                out *= c1 + c2 * out
+                out += c0
+            self.Tb = out    # 亮温
+            return self.Tb
@@ -0,0 +1,75 @@
+# lc2latlon的CUDA实现. 由lc2latlon在首次计算大尺寸网格时才导入并检查CUDA设备是否可用,
+# 未安装numba或没有可用的CUDA设备时回退到CPU实现. 导入本模块不初始化CUDA驱动
+import math
+import numpy as np
+from numba import cuda
+
+# 每个线程块16x16个线程
+_BLOCK = (16, 16)
+
+@cuda.jit
+def _lc2latlon_cuda_kernel(cos_x, sin_x, cos_y, sin_y, k_in, h, ea, eb, sub_lon, lon_out, lat_out):
+    """
+    每个线程计算一个像元的经纬度, 计算过程与_geoloc_numba._lc2latlon_kernel相同
+
+    列方向的cos_x, sin_x长度为列数, 行方向的cos_y, sin_y, k长度为行数, 在设备端只占一维数组的显存
+    """
+    # 线程的x方向对应列号, 同一warp内的线程写入相邻地址
+    j, i = cuda.grid(2)
+    if i >= lon_out.shape[0] or j >= lon_out.shape[1]:
+        return
+    ratio = (ea * ea) / (eb * eb)
+    cx, sx = cos_x[j], sin_x[j]
+    cy, sy = cos_y[i], sin_y[i]
+    k = k_in[i]
+
+    sd2 = (h * cx * cy) ** 2 - k * ((h * h) - (ea * ea))
+    if sd2 < 0:
+        # 视线与地球不相交(圆盘外)
+        lon_out[i, j] = math.nan
+        lat_out[i, j] = math.nan
+        return
+    sn = (h * cx * cy - math.sqrt(sd2)) / k
+
+    S1 = h - (sn * cx * cy)
+    S2 = sn * sx * cy
+    S3 = -sn * sy
+    Sxy = math.sqrt(S1 * S1 + S2 * S2)
+
+    lon = math.degrees(math.atan(S2 / S1)) + sub_lon
+    # 经度限定在[-180, 180)
+    if lon >= 180:
+        lon -= 360
+    elif lon < -180:
+        lon += 360
+    lon_out[i, j] = lon
+    lat_out[i, j] = math.degrees(math.atan(ratio * S3 / Sxy))
+
+def lc2latlon_grid(cos_x, sin_x, cos_y, sin_y, k, h, ea, eb, sub_lon):
+    """
+    在GPU上计算整个行列号网格的经纬度
+
+    Parameters
+    -----
+    cos_x, sin_x : array
+        各列扫描角的余弦、正弦, 形状为(C,)
+    cos_y, sin_y : array
+        各行扫描角的余弦、正弦, 形状为(L,)
+    k : array
+        各行的cos(y)^2 + ea^2/eb^2*sin(y)^2, 形状为(L,)
+    h, ea, eb, sub_lon : float
+        卫星高度、地球半长轴、半短轴及星下点经度
+
+    Returns
+    -----
+    lon : 经度(float32). 形状为(L, C).
+    lat : 纬度(float32). 形状为(L, C).
+    """
+    lines, columns = cos_y.size, cos_x.size
+    d_lon = cuda.device_array((lines, columns), dtype=np.float32)
+    d_lat = cuda.device_array((lines, columns), dtype=np.float32)
+    grid = ((columns + _BLOCK[0] - 1) // _BLOCK[0], (lines + _BLOCK[1] - 1) // _BLOCK[1])
+    _lc2latlon_cuda_kernel[grid, _BLOCK](
+        *[cuda.to_device(np.ascontiguousarray(v, dtype=np.float64)) for v in (cos_x, sin_x, cos_y, sin_y, k)],
+        h, ea, eb, sub_lon, d_lon, d_lat)
+    return d_lon.copy_to_host(), d_lat.copy_to_host()
@@ -0,0 +1,45 @@
+# lc2latlon的numba实现. 未安装numba时导入本模块会抛出ImportError, 由lc2latlon回退到numpy实现
+import math
+import numpy as np
+from numba import njit
+
+# 不启用nnan/ninf, 以保证圆盘外像元的NaN能正确写出.
+# 不使用parallel=True: 多个线程同时构造agri/ghi时会同时调用本函数, 而numba的workqueue线程层
+# (未安装TBB/OpenMP时的默认实现)不支持多个线程同时进入并行区域, 会直接终止进程
+@njit(fastmath={'nsz', 'arcp', 'contract', 'afn', 'reassoc'}, cache=True)
+def _lc2latlon_kernel(cos_x, sin_x, cos_y, sin_y, k_in, h, ea, eb, sub_lon, lon_out, lat_out):
+    """
+    逐像元计算经纬度, 所有中间量均为标量, 整个计算只遍历一次数组
+
+    输入为扫描角的三角函数及k = cos(y)^2 + ea^2/eb^2*sin(y)^2, 均为广播后的二维数组(可为步长为0的视图),
+    网格输入时只按行/列计算, 循环内不再调用sin/cos
+    """
+    ratio = (ea * ea) / (eb * eb)
+    for i in range(lon_out.shape[0]):
+        for j in range(lon_out.shape[1]):
+            cx, sx = cos_x[i, j], sin_x[i, j]
+            cy, sy = cos_y[i, j], sin_y[i, j]
+            k = k_in[i, j]
+
+            sd2 = (h * cx * cy) ** 2 - k * ((h * h) - (ea * ea))
+            if sd2 < 0:
+                # 视线与地球不相交(圆盘外)
+                lon_out[i, j] = np.nan
+                lat_out[i, j] = np.nan
+                continue
+            sn = (h * cx * cy - math.sqrt(sd2)) / k
+
+            S1 = h - (sn * cx * cy)
+            S2 = sn * sx * cy
+            S3 = -sn * sy
+            Sxy = math.sqrt(S1 * S1 + S2 * S2)
+
+            # 圆盘内S1, Sxy恒为正, 不存在象限问题, 用atan即可(比atan2快约1/3)
+            lon = math.degrees(math.atan(S2 / S1)) + sub_lon
+            # 经度限定在[-180, 180)
+            if lon >= 180:
+                lon -= 360
+            elif lon < -180:
+                lon += 360
+            lon_out[i, j] = lon
+            lat_out[i, j] = math.degrees(math.atan(ratio * S3 / Sxy))
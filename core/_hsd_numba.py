@@ -0,0 +1,29 @@
+# Himawari HSD辐射定标的numba实现. 未安装numba时导入本模块会抛出ImportError, 由Himawari8回退到numpy实现
+import math
+from numba import njit
+
+# 不启用nnan/ninf, 以保证无效辐射率产生的NaN能正确写出.
+# 不使用parallel=True: 常以线程池同时读取全圆盘的10个分段文件, 而numba的workqueue线程层
+# (未安装TBB/OpenMP时的默认实现)不支持多个线程同时进入并行区域, 会直接终止进程
+@njit(fastmath={'nsz', 'arcp', 'contract', 'afn', 'reassoc'}, cache=True)
+def _hsd_albedo_kernel(dn, gain, offset, coef, radiance_out, out):
+    """
+    逐像元计算辐射率及反射率, 只遍历一次DN数组
+    """
+    for i in range(dn.size):
+        r = dn[i] * gain + offset
+        radiance_out[i] = r
+        out[i] = r * coef
+
+@njit(fastmath={'nsz', 'arcp', 'contract', 'afn', 'reassoc'}, cache=True)
+def _hsd_tb_kernel(dn, gain, offset, a, b, c0, c1, c2, radiance_out, out):
+    """
+    逐像元计算辐射率及亮温, 只遍历一次DN数组
+
+    a, b为普朗克公式系数(见Himawari8._planck_coefs), 辐射率单位为W / (m2 * sr * μm)
+    """
+    for i in range(dn.size):
+        r = dn[i] * gain + offset
+        radiance_out[i] = r
+        te = a / math.log(b / r + 1)    # 有效亮温
+        out[i] = c0 + te * (c1 + c2 * te)
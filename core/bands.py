@@ -0,0 +1,54 @@
+from dataclasses import dataclass
+from typing import Any
+import h5py
+import numpy as np
+from .h5utils import read_dataset
+
+# GIIRS变量名与(波段, 字段)的对应关系
+VAR_FIELDS = {
+    'VIS': ('VIS', 'data'),
+    'NEdRLW': ('LW', 'NEdR'),
+    'RealLW': ('LW', 'Real'),
+    'ImaginaryLW': ('LW', 'Imaginary'),
+    'NEdRMW': ('MW', 'NEdR'),
+    'RealMW': ('MW', 'Real'),
+    'ImaginaryMW': ('MW', 'Imaginary'),
+}
+
+@dataclass
+class BandData:
+    """
+    GIIRS单个波段的数据
+
+    同一波段的各辐射变量(NEdR, Real, Imaginary)共用一份经纬度及波数数组, 不重复读取和存储.
+    各字段可先存放h5py.Dataset句柄, 通过get首次访问时才读入内存
+    """
+    dims: list
+    latitude: Any
+    longitude: Any
+    wavelength: Any             # 可见光波段为'single'
+    data: Any = None            # 可见光DN值
+    NEdR: Any = None
+    Real: Any = None
+    Imaginary: Any = None
+
+    def get(self, name):
+        """
+        返回指定字段的数值, 字段为数据集句柄时读入并替换为数组
+        """
+        value = getattr(self, name)
+        if isinstance(value, h5py.Dataset):
+            value = read_dataset(value)
+            setattr(self, name, value)
+        return value
+
+    def view(self, name):
+        """
+        按原有data[varname]的字典结构返回指定变量, 其中数组均为引用, 不复制
+        """
+        return {'data': self.get(name),
+                'dims': self.dims,
+                'latitude': self.get('latitude'),
+                'longitude': self.get('longitude'),
+                'wavelength': self.get('wavelength'),
+                }
@@ -0,0 +1,120 @@
+import numpy as np
+from .h5utils import read_dataset
+
+try:
+    from numba import njit
+except ImportError:     # numba为可选依赖, 未安装时使用numpy实现
+    njit = None
+
+if njit is not None:
+    @njit(cache=True)
+    def _lut_calibrate_kernel(nom, lut, nom_min, nom_max, nom_fill_value, out):
+        """
+        逐像元查表并处理无效值, 每个DN值只读取一次, 不生成掩码数组
+
+        不使用parallel=True: 本函数在agri.calibrate的线程池及dask的多个线程中同时调用, 并行已由调用方提供,
+        而numba的workqueue线程层不支持多个线程同时进入并行区域(会直接终止进程)
+        """
+        for i in range(nom.size):
+            v = nom[i]
+            if v == nom_fill_value or v < nom_min or v > nom_max:
+                out[i] = np.nan
+            else:
+                out[i] = lut[v]
+else:
+    _lut_calibrate_kernel = None
+
+def lut_calibrate(nom, cal, nom_channel=None):
+    """
+    查表法辐射定标: 以DN值为索引, 从定标表中取出对应的物理量
+
+    Parameters
+    -----
+    nom : h5py.Dataset
+        待定标的数据集(DN值)
+    cal : h5py.Dataset
+        用于定标的查找表数据集
+    nom_channel : array, optional
+        已读入内存的nom数值, 默认从nom读取
+
+    Returns
+    -----
+    target_channel : array
+        辐射定标后的数据(float32), 无效值为NaN
+    """
+    if nom_channel is None:
+        nom_channel = read_dataset(nom)
+    return apply_lut(nom_channel, *build_lut(nom, cal))
+
+def build_lut(nom, cal):
+    """
+    读取定标表并构建查找表
+
+    Parameters
+    -----
+    nom : h5py.Dataset
+        待定标的数据集(DN值), 仅读取其属性
+    cal : h5py.Dataset
+        用于定标的查找表数据集
+
+    Returns
+    -----
+    lut : array
+        float32查找表, 填充值及超出有效范围的值为NaN
+    nom_min, nom_max : int
+        DN值有效范围(已限定在查找表长度内)
+    nom_fill_value : int
+        DN填充值
+    """
+    cal_channel = read_dataset(cal)
+
+    # 读取数据集属性
+    nom_min, nom_max = nom.attrs['valid_range']
+    cal_min, cal_max = cal.attrs['valid_range']
+    nom_fill_value = nom.attrs['FillValue']
+    cal_fill_value = cal.attrs['FillValue']
+
+    # 构建定标查找表, 填充值及超出有效范围的值直接置为NaN, 查表后自然传递到结果中
+    lut = cal_channel.astype(np.float32)
+    lut[(cal_channel == cal_fill_value) | (cal_channel < cal_min) | (cal_channel > cal_max)] = np.nan
+    # 超出查找表长度的DN值同样视为无效
+    nom_min, nom_max = max(nom_min, 0), min(nom_max, lut.size - 1)
+    return lut, int(nom_min), int(nom_max), int(np.ravel(nom_fill_value)[0])
+
+def apply_lut(nom_channel, lut, nom_min, nom_max, nom_fill_value):
+    """
+    以DN值查表, 不在有效范围内的DN值及填充值置为NaN
+
+    参数为DN数组及build_lut的返回值, 也可作为dask.array.map_blocks的逐块函数
+
+    Returns
+    -----
+    target_channel : array
+        辐射定标后的数据(float32), 无效值为NaN
+    """
+    if _lut_calibrate_kernel is not None and nom_channel.dtype.kind in 'iu' and nom_channel.dtype.isnative:
+        target_channel = np.empty(nom_channel.shape, dtype=np.float32)
+        _lut_calibrate_kernel(np.ascontiguousarray(nom_channel).reshape(-1), lut, nom_min, nom_max,
+                              nom_fill_value, target_channel.reshape(-1))
+        return target_channel
+
+    if nom_channel.dtype.kind == 'u' and nom_channel.dtype.itemsize <= 2:
+        # 8/16位无符号DN: 将有效范围及填充值的判断并入覆盖全部DN值的查找表(16位时为256 KiB),
+        # 逐像元只需一次查表, 无需掩码
+        full_lut = np.full(2 ** (8 * nom_channel.dtype.itemsize), np.nan, dtype=np.float32)
+        full_lut[nom_min:nom_max + 1] = lut[nom_min:nom_max + 1]
+        if 0 <= nom_fill_value < full_lut.size:
+            full_lut[nom_fill_value] = np.nan
+        return np.take(full_lut, nom_channel)
+
+    # 辐射定标(查表)
+    target_channel = np.take(lut, nom_channel, mode='clip')
+
+    # 无效值处理(包括不在范围及填充值). 各比较结果写入同一缓冲区, 不产生额外的临时数组
+    invalid = np.empty(nom_channel.shape, dtype=bool)
+    tmp = np.empty(nom_channel.shape, dtype=bool)
+    np.less(nom_channel, nom_min, out=invalid)
+    np.logical_or(invalid, np.greater(nom_channel, nom_max, out=tmp), out=invalid)
+    np.logical_or(invalid, np.equal(nom_channel, nom_fill_value, out=tmp), out=invalid)
+    target_channel[invalid] = np.nan
+    return target_channel
@@ -0,0 +1,100 @@
+import itertools
+import os
+import zlib
+import h5py
+import numpy as np
+
+# HDF5分块缓存参数. h5py默认仅1 MiB/521个槽位, 小于FY4 L1通道数据集的单个分块, 重复访问时会反复解压
+RDCC_NBYTES = 64 * 1024 * 1024
+RDCC_NSLOTS = 6151      # 取质数以减少哈希冲突
+RDCC_W0 = 0.75
+
+def open_hdf(fpath):
+    """
+    以只读方式打开HDF5文件, 并设置足够容纳FY4数据分块的缓存
+
+    缓存按需占用内存, 未读取的数据集不占用. 大于缓存的分块(如GHI 250m通道整幅为一个分块)在整体读取时
+    由HDF5直接解压到目标数组, 只解压一次, 无需按最大分块扩大缓存(那样需在打开前额外遍历一次全部数据集).
+
+    Parameters
+    -----
+    fpath : str
+        数据文件路径
+
+    Returns
+    -----
+    f : h5py.File
+        HDF5文件对象
+    """
+    return h5py.File(fpath, "r", rdcc_nbytes=RDCC_NBYTES, rdcc_nslots=RDCC_NSLOTS, rdcc_w0=RDCC_W0)
+
+def read_dataset(dset, out=None, concurrent=False):
+    """
+    将HDF5数据集完整读入预分配的数组
+
+    与dset[:]相比, read_direct直接写入目标数组, 分块数据集无需h5py逐块分配临时缓冲区再拷贝.
+    不应直接在Dataset上做带步长的切片(如dset[::4]), h5py为此构造选择区域很慢; 应先用本函数完整读入, 再由numpy切片.
+
+    Parameters
+    -----
+    dset : h5py.Dataset
+        HDF5数据集
+    out : array, optional
+        写入结果的数组(C连续, 形状与dset一致), 默认新分配
+    concurrent : bool, default=False
+        调用方是否在多个线程中同时读取不同数据集. 为True且有多个CPU时, 仅经gzip压缩的数据集在h5py的锁之外解压.
+        单线程读取时该方式比read_direct慢约10%, 因此默认不使用
+
+    Returns
+    -----
+    arr : array
+        数据集数值, 形状及数据类型与dset一致(字节序为本机字节序)
+    """
+    # 以本机字节序分配数组, 由HDF5在读取时完成字节序转换
+    arr = np.empty(dset.shape, dset.dtype.newbyteorder('=')) if out is None else out
+    if not (concurrent and (os.cpu_count() or 1) > 1 and _read_gzip_chunks(dset, arr)):
+        dset.read_direct(arr)
+    return arr
+
+def _read_gzip_chunks(dset, arr):
+    """
+    逐块读取仅经gzip压缩的分块数据集, 并在HDF5之外解压
+
+    h5py的全局锁在整个读取期间(包括HDF5内部的解压)持有, 多线程同时读取不同数据集时实际是串行的.
+    此处在锁内只读取压缩后的原始分块, 解压由zlib完成(解压期间释放GIL), 多个线程各自读取不同通道时可并行解压.
+
+    Returns
+    -----
+    done : bool
+        是否已完成读取. 数据集不满足条件(非分块、过滤器不是仅有deflate、存在未写入的分块)时返回False, 由调用方改用read_direct
+    """
+    if dset.chunks is None or dset.size == 0 or dset.dtype.kind not in 'biuf':
+        return False
+    # 过滤器管道必须恰好为[deflate]. 不能只看dset.compression: nbit等过滤器与deflate串联时它同样为'gzip',
+    # 但解压后的数据仍需其他过滤器还原
+    plist = dset.id.get_create_plist()
+    if plist.get_nfilters() != 1 or plist.get_filter(0)[0] != h5py.h5z.FILTER_DEFLATE:
+        return False
+    chunks = dset.chunks
+    grid = [range(0, n, c) for n, c in zip(dset.shape, chunks)]
+    if dset.id.get_num_chunks() != np.prod([len(g) for g in grid]):
+        # 存在未写入的分块(应为填充值)
+        return False
+    for offset in itertools.product(*grid):
+        filter_mask, raw = dset.id.read_direct_chunk(offset)
+        # 管道中只有一个过滤器, filter_mask的第0位即对应deflate
+        if not filter_mask & 1:
+            raw = zlib.decompress(raw)
+        chunk = np.frombuffer(raw, dtype=dset.dtype).reshape(chunks)
+        # 边缘分块按数据集范围截取
+        sel = tuple(slice(o, min(o + c, n)) for o, c, n in zip(offset, chunks, dset.shape))
+        arr[sel] = chunk[tuple(slice(0, s.stop - s.start) for s in sel)]
+    return True
+
+def decode_attr(value):
+    """
+    将字符串属性统一转为str
+
+    h5py对定长字符串属性返回bytes, 对变长字符串属性返回str
+    """
+    return value.decode('utf-8') if isinstance(value, bytes) else value
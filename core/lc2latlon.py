@@ -1,5 +1,43 @@
+import functools
+from types import MappingProxyType
 import numpy as np
-from numpy import sin,cos,arctan,pi,sqrt
+from numpy import sin,cos,arctan2,sqrt
+
+try:
+    from ._geoloc_numba import _lc2latlon_kernel
+except ImportError:     # numba为可选依赖, 未安装时使用numpy实现
+    _lc2latlon_kernel = None
+
+# 网格像元数不少于此值时才使用GPU计算, 较小的网格拷贝及启动开销大于计算本身
+_CUDA_MIN_SIZE = 2 ** 22
+
+# 风云4号L1数据各空间分辨率(m)对应的(行/列偏移, 行/列比例因子), 只读
+_FY4_RES_PARAMS = MappingProxyType({
+    250: (21983.5, 163730199),
+    500: (10991.5, 81865099),
+    1000: (5495.5, 40932549),
+    2000: (2747.5, 20466274),
+    4000: (1373.5, 10233137),
+})
+
+@functools.lru_cache(maxsize=None)
+def _cuda_geoloc():
+    """
+    返回GPU网格计算函数, 不可用时返回None
+
+    首次需要GPU计算时才导入numba.cuda并检查设备, 导入本模块时不初始化CUDA驱动
+    (避免拖慢导入, 以及fork出的子进程继承已初始化的CUDA上下文)
+    """
+    try:
+        from numba import cuda
+        from ._geoloc_cuda import lc2latlon_grid
+    except ImportError:     # numba为可选依赖
+        return None
+    return lc2latlon_grid if cuda.is_available() else None
+
+def _as_float(value):
+    # 文件属性信息中的参数多为长度为1的数组
+    return float(np.asarray(value).reshape(-1)[0])
 
 def lc2latlon(x, y, sat, **kwargs):
     """
@@ -8,9 +46,10 @@ def lc2latlon(x, y, sat, **kwargs):
     Parameters
     -----
     x : int
-        行号. 一维数组或列表, 长度等于坐标点的个数.
+        列号. 数组或列表, 形状应能与y广播.
+        传入形状为(C,)的列号与形状为(L, 1)的行号时, 直接得到(L, C)的网格结果, 无需meshgrid.
     y : int
-        列号. 一维数组或列表, 长度等于坐标点的个数且应与x的长度相等.
+        行号. 数组或列表, 形状应能与x广播.
     sat : str
         卫星名称. 'FY4' or 'Himawari8'.
     sub_lon : float
@@ -35,8 +74,8 @@ def lc2latlon(x, y, sat, **kwargs):
 
     Returns
     -----
-    lon : 经度.
-    lat : 纬度.
+    lon : 经度. 形状为x与y广播后的形状.
+    lat : 纬度. 形状为x与y广播后的形状.
     """
     
     # 基本参数
@@ -47,63 +86,128 @@ def lc2latlon(x, y, sat, **kwargs):
     }
     default_parameters.update(kwargs)
     if sat == 'FY4' and 'resolution' in kwargs.keys():
-        # 根据分辨率确定参数
-        if kwargs['resolution'] in [250, '250']:
-            default_parameters['COFF'] = 21983.5
-            default_parameters['CFAC'] = 163730199
-            default_parameters['LOFF'] = 21983.5 
-            default_parameters['LFAC'] = 163730199 
-        elif kwargs['resolution'] in [500, '500']:
-            default_parameters['COFF'] = 10991.5 
-            default_parameters['CFAC'] = 81865099 
-            default_parameters['LOFF'] = 10991.5 
-            default_parameters['LFAC'] = 81865099 
-        elif kwargs['resolution'] in [1000, '1000']:
-            default_parameters['COFF'] = 5495.5  
-            default_parameters['CFAC'] = 40932549 
-            default_parameters['LOFF'] = 5495.5 
-            default_parameters['LFAC'] = 40932549 
-        elif kwargs['resolution'] in [2000, '2000']:
-            default_parameters['COFF'] = 2747.5  
-            default_parameters['CFAC'] = 20466274  
-            default_parameters['LOFF'] = 2747.5 
-            default_parameters['LFAC'] = 20466274 
-        elif kwargs['resolution'] in [4000, '4000']:
-            default_parameters['COFF'] = 1373.5  
-            default_parameters['CFAC'] = 10233137
-            default_parameters['LOFF'] = 1373.5  
-            default_parameters['LFAC'] = 10233137  
-        else:
-            raise ValueError("风云4号卫星L1数据的resolution参数应为250, 500, 1000, 2000或4000")
-    h, ea, eb = default_parameters['h'], default_parameters['ea'], default_parameters['eb']
-
-    row = np.array(y)
-    col = np.array(x)
-
-    x = pi / 180.0 * (col - default_parameters['COFF']) / (2**-16 * default_parameters['CFAC'])
-    y = pi / 180.0 * (row - default_parameters['LOFF']) / (2**-16 * default_parameters['LFAC'])
+        # 根据分辨率确定参数(行、列方向参数相同)
+        try:
+            off, fac = _FY4_RES_PARAMS[float(kwargs['resolution'])]
+        except (KeyError, ValueError, TypeError):
+            raise ValueError("风云4号卫星L1数据的resolution参数应为250, 500, 1000, 2000或4000") from None
+        default_parameters.update(COFF=off, CFAC=fac, LOFF=off, LFAC=fac)
+    # 文件中读取的参数多为长度为1的数组, 统一转为标量
+    COFF, CFAC, LOFF, LFAC, h, ea, eb, sub_lon = [_as_float(default_parameters[k]) for k in ['COFF', 'CFAC', 'LOFF', 'LFAC', 'h', 'ea', 'eb', 'sub_lon']]
+
+    # 扫描角用float64计算(网格输入时均为一维, 开销可忽略)
+    # 仅转换(复制)一次, 其余均原地运算, 避免散点输入时产生多个同尺寸临时数组
+    x = np.array(x, dtype=np.float64)
+    x -= COFF
+    x /= 2**-16 * CFAC
+    np.deg2rad(x, out=x)
+    y = np.array(y, dtype=np.float64)
+    y -= LOFF
+    y /= 2**-16 * LFAC
+    np.deg2rad(y, out=y)
+    # 三角函数只取决于行或列, 网格输入时每行/每列只计算一次
+    cx, sx = cos(x), sin(x)
+    cy, sy = cos(y), sin(y)
+    ratio = (ea * ea) / (eb * eb)
+    k = cy * cy + ratio * sy * sy
+    shape = np.broadcast_shapes(x.shape, y.shape)
+
+    if (len(shape) == 2 and x.shape[-1:] == (x.size,) == shape[1:] and y.shape == (shape[0], 1)
+            and x.size * y.size >= _CUDA_MIN_SIZE and _cuda_geoloc() is not None):
+        # 网格输入(列号(C,)或(1, C), 行号(L, 1))且尺寸较大时由GPU计算
+        return _cuda_geoloc()(cx.ravel(), sx.ravel(), cy.ravel(), sy.ravel(), k.ravel(), h, ea, eb, sub_lon)
+
+    if _lc2latlon_kernel is not None:
+        # 以广播视图传入, 网格输入时不展开成完整网格
+        cx, sx, cy, sy, k = [np.broadcast_to(v, shape) for v in (cx, sx, cy, sy, k)]
+        if len(shape) != 2:
+            # 非网格输入按(N, 1)处理
+            cx, sx, cy, sy, k = [v.reshape(-1, 1) for v in (cx, sx, cy, sy, k)]
+        lon = np.empty(cx.shape, dtype=np.float32)
+        lat = np.empty(cx.shape, dtype=np.float32)
+        _lc2latlon_kernel(cx, sx, cy, sy, k, h, ea, eb, sub_lon, lon, lat)
+        return lon.reshape(shape)[()], lat.reshape(shape)[()]
 
     with np.errstate(invalid='ignore'):
         #  临时忽略警告
-        sd = sqrt(
-            (h * cos(x) * cos(y)) ** 2
-            - (cos(y) * cos(y) + (ea * ea) / (eb * eb) * sin(y) * sin(y)) 
-            * ((h * h) - (ea * ea))
-            )
+        # sd^2 = k*ea^2 - h^2*(cos(y)^2*sin(x)^2 + ratio*sin(y)^2), 圆盘边缘处为两个相近的数相减, 保留float64.
+        # 括号内各项只取决于行或列, 全尺寸的float64数组只有一个, 原地运算后转为float32
+        sd = np.multiply((h * h) * cy * cy, sx * sx, out=np.empty(shape))
+        np.subtract(k * (ea * ea) - (h * h) * ratio * sy * sy, sd, out=sd)
+        np.sqrt(sd, out=sd)
+        sd = sd.astype(np.float32)
+
+    # 其余逐像元计算使用float32, 内存带宽及临时数组占用减半.
+    # 全尺寸数组均预先分配并原地运算, 用完的缓冲区复用于后续变量, 同时存在的不超过4个
+    f32 = np.float32
+    cx, sx, cy, sy, k = [v.astype(np.float32) for v in (cx, sx, cy, sy, k)]
+    ratio = f32(ratio)
+    cxcy = np.multiply(cx, cy, out=np.empty(shape, f32))
+    # q = k - (cos(x)cos(y))^2, 以q改写S1同样避免两个大数相减
+    q = np.multiply(cy * cy, sx * sx, out=np.empty(shape, f32))
+    q += ratio * sy * sy
 
-        sn = (h * cos(x) * cos(y) - sd) / (cos(y) * cos(y) + (ea * ea) / (eb * eb) * sin(y) * sin(y))
+    with np.errstate(invalid='ignore'):
+        # sn = (h*cos(x)cos(y) - sd) / k
+        sn = np.multiply(cxcy, f32(h), out=np.empty(shape, f32))
+        sn -= sd
+        sn /= k
+
+        # S1 = (h*q + sd*cos(x)cos(y)) / k, 存放于q
+        S1 = q
+        S1 *= f32(h)
+        sd *= cxcy
+        S1 += sd
+        S1 /= k
+        # S2 = sn*sin(x)cos(y), 存放于sd
+        S2 = np.multiply(sn, sx, out=sd)
+        S2 *= cy
+        # ratio*S3 = -ratio*sn*sin(y), 存放于sn
+        S3 = sn
+        S3 *= -ratio * sy
+        Sxy = np.hypot(S1, S2, out=cxcy)
+
+        lon = arctan2(S2, S1, out=S2)
+        np.rad2deg(lon, out=lon)
+        lon += f32(sub_lon)
+        lat = arctan2(S3, Sxy, out=S3)
+        np.rad2deg(lat, out=lat)
 
-        S1 = h - (sn * cos(x) * cos(y))
-        S2 = sn * sin(x) * cos(y)
-        S3 = -sn * sin(y)
-        Sxy = sqrt(S1 * S1 + S2 * S2)
+    # 经度限定在[-180, 180), 原地运算
+    lon += f32(180)
+    np.mod(lon, f32(360), out=lon)
+    lon -= f32(180)
 
-        lon = 180 / pi * arctan(S2 / S1) + default_parameters['sub_lon']
-        lat = 180 / pi * arctan((ea * ea) / (eb * eb) * S3 / Sxy)
+    # 标量输入时返回标量
+    return lon[()], lat[()]
 
-    lat = np.array(lat, dtype=np.float32)
-    lon = np.array(lon, dtype=np.float32)
+@functools.lru_cache(maxsize=8)
+def _geoloc_for(resolution, sub_lon, bl, el, bp, ep):
+    """
+    计算FY4标称行列号范围内的经纬度网格
+
+    结果只取决于分辨率、星下点经度和行列号范围, 同一卫星同一区域的多个时次文件共用同一份缓存.
+    返回的数组为只读, 避免修改缓存内容.
 
-    lon = np.where(lon>180, lon-360, lon)
+    Parameters
+    -----
+    resolution : float
+        空间分辨率(m)
+    sub_lon : float
+        星下点经度
+    bl, el : int
+        标称下的起始、末尾行号
+    bp, ep : int
+        标称下的起始、末尾列号
 
-    return lon, lat
\ No newline at end of file
+    Returns
+    -----
+    lon : 经度. 形状为(行数, 列数).
+    lat : 纬度. 形状为(行数, 列数).
+    """
+    columns = np.arange(bp, ep+1, 1)
+    lines = np.arange(bl, el+1, 1)
+    lon, lat = lc2latlon(columns[np.newaxis, :], lines[:, np.newaxis], sat='FY4', resolution=resolution, sub_lon=sub_lon)
+    lon.setflags(write=False)
+    lat.setflags(write=False)
+    return lon, lat